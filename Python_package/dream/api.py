@@ -1,18 +1,45 @@
+import asyncio
 import io
 import json
 import pandas as pd
 import numpy as np
+import orjson
 from flask import Flask, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from dream.chemicals import pairwise_fingerprint_similarity
 from dream.chemicals import pairwise_mcs_similarity
 
 
 from dream.genetic_algorithm import genetic_algorithm
+from dream.genetic_algorithm.ga_ops import unpack_bits
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson, which serializes the large lists of
+    distances and individuals much faster than the standard json module and
+    handles NumPy scalars and arrays natively.
+    """
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # hand the encoded bytes to the response without a round trip to str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype
+        )
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 @app.route("/chemicals_distance", methods=["GET", "POST"])
-def chemicals_distance():
+async def chemicals_distance():
     parameters = request.args.to_dict(flat=True)
     method = parameters.pop("method", "fingerprint")
     data = request.get_json()
@@ -23,14 +50,19 @@ def chemicals_distance():
     try:
         if method == "mcs":
             only_heavy_atoms = (parameters.pop("only_heavy_atoms", "TRUE") == "TRUE")
-            similarities = pairwise_mcs_similarity(
-                smiles, only_heavy_atoms=only_heavy_atoms
+            similarities = await asyncio.to_thread(
+                pairwise_mcs_similarity,
+                smiles,
+                only_heavy_atoms=only_heavy_atoms
             )
         elif method == "fingerprint":
             radius = int(parameters.pop("radius", 4))
             n_bits = int(parameters.pop("n_bits", 2048))
-            similarities = pairwise_fingerprint_similarity(
-                smiles, radius=radius, n_bits=n_bits
+            similarities = await asyncio.to_thread(
+                pairwise_fingerprint_similarity,
+                smiles,
+                radius=radius,
+                n_bits=n_bits
             )
         else:
             # http 400 error code: bad request: https://http.cat/400
@@ -38,11 +70,20 @@ def chemicals_distance():
     except Exception as err:
         return jsonify({"error": str(err)}), 400
     # negative log transformation converts the similarity to a distance
-    distances = [(rev_smiles_dict[mol1], rev_smiles_dict[mol2], -np.log(max(1e-5, sim))) for (mol1, mol2, sim) in similarities]
+    sims = np.fromiter(
+        (sim for (_, _, sim) in similarities),
+        dtype=np.float64,
+        count=len(similarities)
+    )
+    dists = -np.log(np.clip(sims, 1e-5, None))
+    distances = [
+        (rev_smiles_dict[mol1], rev_smiles_dict[mol2], dist)
+        for ((mol1, mol2, _), dist) in zip(similarities, dists.tolist())
+    ]
     return jsonify({"distances": distances})
 
 @app.route("/genetic_algorithm", methods=["GET", "POST"])
-def genetic_algorithm_api():
+async def genetic_algorithm_api():
     parameters = request.args.to_dict(flat=True)
 
     population_size = int(parameters.pop("population_size", 100))
@@ -52,6 +93,8 @@ def genetic_algorithm_api():
     crossover_prob = float(parameters.pop("crossover_prob", 0.7))
     mutation_prob = float(parameters.pop("mutation_prob", 0.3))
     n_generations = int(parameters.pop("n_generations", 2500))
+    n_jobs = parameters.pop("n_jobs", None)
+    n_jobs = int(n_jobs) if n_jobs is not None else None
 
     data = request.get_json()
     smiles_distances = data.pop("smiles_distances", None)
@@ -75,7 +118,9 @@ def genetic_algorithm_api():
             {"error": "{} is missing or not well formatted".format(str(e))}
         )
 
-    drug_names, population, logbook, hall_of_fame = genetic_algorithm(
+    # the run takes long, keep it off the event loop
+    drug_names, population, logbook, hall_of_fame = await asyncio.to_thread(
+        genetic_algorithm,
         smiles_distances=smiles_distances,
         moa_distances=moa_distances,
         graph_distances=graph_distances,
@@ -89,9 +134,15 @@ def genetic_algorithm_api():
         crossover_prob=crossover_prob,
         mutation_prob=mutation_prob,
         n_generations=n_generations,
+        n_jobs=n_jobs,
         verbose=False,
     )
 
+    # clients expect one 0/1 flag per drug
+    population = [
+        unpack_bits(individual, len(drug_names)).astype(np.uint8).tolist()
+        for individual in population
+    ]
     return jsonify({
         "drug_names": drug_names,
         "population": population,
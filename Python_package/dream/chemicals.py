@@ -1,8 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+import numpy as np
 from itertools import combinations
 from rdkit import Chem
 from rdkit import DataStructs
-from rdkit.Chem import AllChem
+from rdkit.Chem import rdFingerprintGenerator
 from rdkit.Chem import rdFMCS
 
 def pairwise_fingerprint_similarity(smiles, radius=4, n_bits=2048):
@@ -35,18 +37,51 @@ def pairwise_fingerprint_similarity(smiles, radius=4, n_bits=2048):
      ('CCO', 'CCC', 0.42857142857142855),
      ('CCN', 'CCC', 0.42857142857142855)]
     """
-    fps = {s: ECFP(s, radius=radius, n_bits=n_bits) for s in smiles}
+    # the SMILES of a single call are distinct, so skip the ECFP and
+    # mol_from_smiles caches and their locks
+    generator = morgan_generator(radius, n_bits)
+    fps = {s: generator.GetFingerprint(Chem.MolFromSmiles(s)) for s in smiles}
+    names = list(fps.keys())
+    # all pairwise intersections with a single matrix product; the counts are
+    # exact in float32, the ratio is taken in float64 like RDKit does
+    X = fingerprint_matrix(fps.values())
+    intersection = (X @ X.T).astype(np.float64)
+    popcount = np.diag(intersection)
+    union = popcount[:, None] + popcount[None, :] - intersection
+    sims = np.divide(
+        intersection, union, out=np.zeros_like(intersection), where=union > 0
+    )
+    rows, cols = np.triu_indices(len(names), k=1)
     similarities = [
-        (
-            smiles1,
-            smiles2,
-            DataStructs.TanimotoSimilarity(fp1, fp2)
-        ) 
-        for ((smiles1, fp1), (smiles2, fp2)) in combinations(fps.items(), 2)
+        (names[i], names[j], sim)
+        for i, j, sim in zip(rows, cols, sims[rows, cols].tolist())
     ]
     return similarities
 
-def pairwise_mcs_similarity(smiles, only_heavy_atoms=False):
+def fingerprint_matrix(fps):
+    """
+    Stack RDKit bit vectors into a dense matrix with one fingerprint per row.
+
+    Parameters:
+    -----------
+    fps: iterable of rdkit.DataStructs.cDataStructs.ExplicitBitVect
+        The fingerprints to stack, all of the same length.
+
+    Returns:
+    --------
+    numpy.ndarray
+        A float32 array of shape (n_fingerprints, n_bits) holding 0/1 values.
+    """
+    packed = [
+        np.frombuffer(DataStructs.BitVectToBinaryText(fp), dtype=np.uint8)
+        for fp in fps
+    ]
+    if len(packed) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    bits = np.unpackbits(np.vstack(packed), axis=1, bitorder="little")
+    return bits.astype(np.float32)
+
+def pairwise_mcs_similarity(smiles, only_heavy_atoms=False, max_workers=None):
     """
     Computes the maximum common substructure (MCS) similarity between each pair
     of molecules represented by the input SMILES strings.
@@ -58,6 +93,9 @@ def pairwise_mcs_similarity(smiles, only_heavy_atoms=False):
         only_heavy_atoms: bool, optional (default=False)
             Consider only heavy atoms (i.e., atoms other than hydrogen) when
             computing the MCS
+        max_workers: int, optional (default=None)
+            The number of threads searching the MCS of the pairs. Defaults to
+            the ThreadPoolExecutor default, based on the number of CPUs.
 
     Returns:
     --------
@@ -75,14 +113,18 @@ def pairwise_mcs_similarity(smiles, only_heavy_atoms=False):
          ('CNC', 'CO', 0.25)]
     """
     mols = {s: mol_from_smiles(s) for s in smiles}
-    similarities = [
-        (
-            smiles1,
-            smiles2,
-            mcs_overlap(mol1, mol2, only_heavy_atoms=True)
-        ) 
-        for ((smiles1, mol1), (smiles2, mol2)) in combinations(mols.items(), 2)
-    ]
+    pairs = list(combinations(mols.items(), 2))
+    # FindMCS runs in C++ without holding the GIL, so threads are enough to
+    # search several pairs at once
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        overlaps = executor.map(
+            lambda pair: mcs_overlap(pair[0][1], pair[1][1], only_heavy_atoms=True),
+            pairs
+        )
+        similarities = [
+            (smiles1, smiles2, overlap)
+            for ((smiles1, _), (smiles2, _)), overlap in zip(pairs, overlaps)
+        ]
     return similarities
 
 def mcs_overlap(query_mol, target_mol, only_heavy_atoms=False):
@@ -180,13 +222,34 @@ def ECFP(smiles, radius=4, n_bits=2048):
     results of previous calls for up to 2048 different inputs. This can speed
     up repeated calls to the function with the same input.
     """
-    info = {}
     mol = mol_from_smiles(smiles)
-    fp = AllChem.GetMorganFingerprintAsBitVect(
-        mol, radius=radius, nBits=n_bits, bitInfo=info
-    )
+    fp = morgan_generator(radius, n_bits).GetFingerprint(mol)
     return fp
 
+@lru_cache(maxsize=None)
+def morgan_generator(radius=4, n_bits=2048):
+    """
+    Get a Morgan fingerprint generator for the given parameters.
+
+    Parameters:
+    -----------
+    radius: int, optional (default=4)
+        The radius of the Morgan fingerprint.
+    n_bits: int, optional (default=2048)
+        The length of the fingerprint in bits.
+
+    Returns:
+    --------
+    rdkit.Chem.rdFingerprintGenerator.FingerprintGenerator64
+        A generator producing ExplicitBitVect fingerprints.
+
+    Notes:
+    ------
+    Generators are cached per parameter combination, so the setup cost is
+    paid once rather than on every fingerprint.
+    """
+    return rdFingerprintGenerator.GetMorganGenerator(radius=radius, fpSize=n_bits)
+
 @lru_cache(maxsize=2048)
 def maximum_common_substructure(mols, timeout=1, as_mol=False):
     """
@@ -0,0 +1,168 @@
+import os
+import numpy as np
+from numba import njit
+
+# the numba kernels of the genetic algorithm; compiled code is cached on disk
+# next to this module and reused by later runs
+
+@njit(cache=True)
+def swap_tails(ind1, ind2, cxpoint):
+    """
+    Swap the bits from position cxpoint on between two packed individuals.
+    """
+    word = cxpoint // 64
+    # whole words past the crossover point
+    for w in range(word + 1, len(ind1)):
+        ind1[w], ind2[w] = ind2[w], ind1[w]
+    # high bits of the word holding it
+    low = (np.uint64(1) << np.uint64(cxpoint % 64)) - np.uint64(1)
+    diff = (ind1[word] ^ ind2[word]) & ~low
+    ind1[word] ^= diff
+    ind2[word] ^= diff
+
+@njit(cache=True)
+def swap_bits(words, positions, partners):
+    """
+    Swap, in order, each bit in positions with the bit at the same index of
+    partners.
+    """
+    for k in range(len(positions)):
+        i = positions[k]
+        j = partners[k]
+        bit_i = (words[i // 64] >> np.uint64(i % 64)) & np.uint64(1)
+        bit_j = (words[j // 64] >> np.uint64(j % 64)) & np.uint64(1)
+        if bit_i != bit_j:
+            words[i // 64] ^= np.uint64(1) << np.uint64(i % 64)
+            words[j // 64] ^= np.uint64(1) << np.uint64(j % 64)
+
+@njit(cache=True)
+def copy_tail(child, donor, cxpoint):
+    """
+    Copy the bits of donor from position cxpoint on into child.
+    """
+    word = cxpoint // 64
+    for w in range(word + 1, len(child)):
+        child[w] = donor[w]
+    low = (np.uint64(1) << np.uint64(cxpoint % 64)) - np.uint64(1)
+    child[word] = (child[word] & low) | (donor[word] & ~low)
+
+@njit(cache=True)
+def popcount(word):
+    """
+    Number of set bits of a uint64 word.
+    """
+    word = word - ((word >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    word = (word & np.uint64(0x3333333333333333)) + (
+        (word >> np.uint64(2)) & np.uint64(0x3333333333333333)
+    )
+    word = (word + (word >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return np.int64((word * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+@njit(cache=True)
+def distances_and_counts(words, n_bits, smiles_mat, moa_mat, paths_mat):
+    """
+    Mean pairwise SMILES, MOA and graph distance of the drugs selected by
+    each packed individual, and their number, as the columns of an array of
+    shape (n_individuals, 4). The means are zero for less than two drugs.
+    """
+    n_individuals, n_words = words.shape
+    out = np.zeros((n_individuals, 4))
+    selected = np.empty(n_bits, dtype=np.int64)
+    one = np.uint64(1)
+    for b in range(n_individuals):
+        k = 0
+        for w in range(n_words):
+            k += popcount(words[b, w])
+        out[b, 3] = k
+        # combinations of less than two drugs have no pair to read
+        if k < 2:
+            continue
+        k = 0
+        for w in range(n_words):
+            word = words[b, w]
+            i = w * 64
+            while word != 0:
+                if word & one:
+                    selected[k] = i
+                    k += 1
+                word >>= one
+                i += 1
+        smiles_sum = 0.0
+        moa_sum = 0.0
+        paths_sum = 0.0
+        # the matrices are symmetric, each pair is read once
+        for p in range(k):
+            i = selected[p]
+            for q in range(p + 1, k):
+                j = selected[q]
+                smiles_sum += smiles_mat[i, j]
+                moa_sum += moa_mat[i, j]
+                paths_sum += paths_mat[i, j]
+        n_pairs = k * (k - 1) / 2
+        out[b, 0] = smiles_sum / n_pairs
+        out[b, 1] = moa_sum / n_pairs
+        out[b, 2] = paths_sum / n_pairs
+    return out
+
+@njit(cache=True, error_model="numpy")
+def score_bitsets(target_rows, rows, graph_rank):
+    """
+    Coverage score of each set of targets; target_rows holds, for each set,
+    the indices in rows of the neighborhood bitsets of its targets.
+
+    The kernel is serial on purpose: fitness evaluations are already spread
+    over worker processes, and Numba's TBB threading layer hangs at exit when
+    launched from the API's worker thread.
+    """
+    n_sets, n_targets = target_rows.shape
+    n_nodes = graph_rank.shape[0]
+    one = np.uint64(1)
+    scores = np.empty(n_sets)
+    for k in range(n_sets):
+        covered = np.zeros(rows.shape[1], dtype=np.uint64)
+        for t in range(n_targets):
+            covered |= rows[target_rows[k, t]]
+        ranks = np.empty(n_nodes)
+        n_covered = 0
+        n_ranked = 0
+        for w in range(covered.shape[0]):
+            word = covered[w]
+            v = w * 64
+            while word != 0:
+                if word & one:
+                    n_covered += 1
+                    if not np.isnan(graph_rank[v]):
+                        ranks[n_ranked] = graph_rank[v]
+                        n_ranked += 1
+                word >>= one
+                v += 1
+        if n_ranked == 0:
+            scores[k] = np.nan
+        else:
+            inform_rank = np.median(ranks[:n_ranked])
+            scores[k] = n_covered / n_nodes / inform_rank
+    return scores
+
+def prewarm():
+    """
+    Compile every kernel, or load it from the on-disk cache, by calling it
+    on inputs of size one with the types used by the genetic algorithm.
+    """
+    ind1 = np.zeros(1, dtype=np.uint64)
+    ind2 = np.zeros(1, dtype=np.uint64)
+    popcount(np.uint64(1))
+    swap_tails(ind1, ind2, 1)
+    swap_bits(ind1, np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64))
+    copy_tail(ind1, ind2, 1)
+    mat = np.zeros((1, 1), dtype=np.float32)
+    distances_and_counts(np.zeros((1, 1), dtype=np.uint64), 1, mat, mat, mat)
+    score_bitsets(
+        np.zeros((1, 1), dtype=np.int64),
+        np.zeros((1, 1), dtype=np.uint64),
+        np.zeros(1)
+    )
+
+# pay the compilation when the package is imported instead of during the
+# first run
+if os.environ.get("DREAM_PREWARM") == "1":
+    prewarm()
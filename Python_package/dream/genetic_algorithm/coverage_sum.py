@@ -1,10 +1,17 @@
 import pandas as pd
 import numpy as np
-import itertools as it
 from scipy.stats import norm
-import igraph as ig 
+from dream.genetic_algorithm._kernels import score_bitsets
 
-def coverage_sum(candidate_drugs, drug_targets, ppi_network, graph_rank):
+def coverage_sum(
+    candidate_drugs,
+    drug_targets,
+    graph_rank,
+    bin_by_vid,
+    bin_members,
+    name_to_vid,
+    neighbor_bits,
+):
     """
     Compute coverage score for a set of candidate drugs based on the proportion
     of nodes in the protein-protein interaction network that are covered by the
@@ -18,12 +25,18 @@ def coverage_sum(candidate_drugs, drug_targets, ppi_network, graph_rank):
     drug_targets : pandas DataFrame
         DataFrame containing drug-target associations with columns
         "dat.drug.molecule_name" and "dat.target.gene_info.symbol".
-    ppi_network : igraph.Graph
-        The PPI network as an igraph.Graph object.
-    graph_rank : pandas DataFrame
-        DataFrame containing the graph rank of the nodes in the ppi network,
-        with one column called "rank" and the row index corresponding to node
-        names.
+    graph_rank : numpy.ndarray
+        The graph rank of the nodes in the ppi network, indexed by vertex id,
+        NaN for nodes without a rank.
+    bin_by_vid : numpy.ndarray
+        The degree bin of each node of the ppi network, indexed by vertex id,
+        as returned by `degree_bin_by_vid`.
+    bin_members : dict
+        Nodes of each degree bin as returned by `degree_bin_members`.
+    name_to_vid : dict
+        A dictionary mapping node names to vertex ids of the ppi network.
+    neighbor_bits : NeighborhoodBits
+        The neighborhoods of the nodes of the ppi network as bitsets.
 
     Returns
     -------
@@ -36,31 +49,90 @@ def coverage_sum(candidate_drugs, drug_targets, ppi_network, graph_rank):
     drug_target_df = drug_targets[
         drug_targets["dat.drug.molecule_name"].isin(candidate_drugs)
     ]
-    # make a df with the nodes of the ppi network sorted by their degree
-    #ppi needs to be a igraph object
-    ppi_network = ig.Graph.TupleList(ppi_network.itertuples(index=False), directed=False, weights=False)
-    deg_dist = pd.DataFrame(
-        data=ppi_network.degree(),
-        index=ppi_network.vs["name"],
-        columns=["dist"]
-    )
-    deg_dist.sort_values(by="dist", inplace=True)
-    deg_dist["bin"] = pd.qcut(deg_dist.dist, q=20, labels=range(20))
     return get_drug_input_coverage(
         candidate_drugs=candidate_drugs, 
-        ppi_network=ppi_network, 
         drug_target_df=drug_target_df, 
         graph_rank=graph_rank, 
-        deg_dist=deg_dist
+        bin_by_vid=bin_by_vid,
+        bin_members=bin_members,
+        name_to_vid=name_to_vid,
+        neighbor_bits=neighbor_bits
     )
 
+def degree_distribution(ppi_network, n_bins=20):
+    """
+    Sort the nodes of the PPI network by degree and split them into quantile
+    bins, used to draw random targets with a similar degree distribution.
+
+    Parameters
+    ----------
+    ppi_network : igraph.Graph
+        The PPI network as an igraph.Graph object.
+    n_bins : int, optional
+        The number of degree quantiles. Default is 20.
+
+    Returns
+    -------
+    pandas DataFrame
+        DataFrame indexed by vertex id with the degree in column "dist" and
+        the degree quantile in column "bin".
+    """
+    deg_dist = pd.DataFrame(
+        data=ppi_network.degree(),
+        index=range(ppi_network.vcount()),
+        columns=["dist"]
+    )
+    deg_dist.sort_values(by="dist", inplace=True)
+    deg_dist["bin"] = pd.qcut(deg_dist.dist, q=n_bins, labels=range(n_bins))
+    return deg_dist
+
+def degree_bin_members(deg_dist):
+    """
+    Group the nodes of the PPI network by degree bin.
+
+    Parameters
+    ----------
+    deg_dist : pandas DataFrame
+        Degree distribution of the ppi network as returned by
+        `degree_distribution`.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping each bin to a numpy array with the vertex ids of
+        its nodes.
+    """
+    return {
+        bin_id: members.index.to_numpy()
+        for bin_id, members in deg_dist.groupby(by="bin", observed=True)
+    }
+
+def degree_bin_by_vid(deg_dist):
+    """
+    Look up the degree bin of the nodes of the PPI network by vertex id.
+
+    Parameters
+    ----------
+    deg_dist : pandas DataFrame
+        Degree distribution of the ppi network as returned by
+        `degree_distribution`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The degree bin of each node, indexed by vertex id.
+    """
+    return deg_dist["bin"].sort_index().to_numpy(dtype=int)
+
 def get_drug_input_coverage(
     candidate_drugs,
-    ppi_network,
     drug_target_df,
     graph_rank,
-    deg_dist,
-    order=1,
+    bin_by_vid,
+    bin_members,
+    name_to_vid,
+    neighbor_bits,
+    n_permutations=100,
 ):
     """
     Permutation test to evaluate the significance of the coverage score for a
@@ -71,21 +143,25 @@ def get_drug_input_coverage(
     ----------
     candidate_drugs : list of str
         List of drug names to consider.
-    ppi_network : igraph.Graph
-        The PPI network as an igraph.Graph object.
     drug_target_df : pandas DataFrame
         DataFrame containing drug-target associations with columns
         "dat.drug.molecule_name" and "dat.target.gene_info.symbol".
-    graph_rank : pandas DataFrame
-        DataFrame containing the graph rank of the nodes in the ppi network,
-        with one column called "rank" and the row index corresponding to node
-        names.
-    deg_dist : pandas DataFrame
-        DataFrame containing the degree distribution of nodes in the ppi
-        network, with one column called "dist" and the row index corresponding
-        to node names.
-    order : int, optional
-        The order of the neighborhood to consider. Default is 1.
+    graph_rank : numpy.ndarray
+        The graph rank of the nodes in the ppi network, indexed by vertex id,
+        NaN for nodes without a rank.
+    bin_by_vid : numpy.ndarray
+        The degree bin of each node of the ppi network, indexed by vertex id,
+        as returned by `degree_bin_by_vid`.
+    bin_members : dict
+        Nodes of each degree bin as returned by `degree_bin_members`.
+    name_to_vid : dict
+        A dictionary mapping node names to vertex ids of the ppi network.
+    neighbor_bits : NeighborhoodBits
+        The neighborhoods of the nodes of the ppi network as bitsets, used to
+        score the observed and the random target sets.
+    n_permutations : int, optional
+        The number of random target sets drawn for the permutation test.
+        Default is 100.
 
     Returns
     -------
@@ -104,85 +180,197 @@ def get_drug_input_coverage(
         ]
     )
     # consider only targets available in ppi network
-    targets = list(set(ppi_network.vs["name"]) & targets)
-    observed = compute_cov_score(targets, ppi_network, graph_rank, order=1)
-    simulated = []
-    for i in range(100):
-        random_targets = generate_random_targets(targets, deg_dist)
-        simulated.append(
-            compute_cov_score(random_targets, ppi_network, graph_rank, order)
-        )
+    target_vids = [name_to_vid[t] for t in targets if t in name_to_vid]
+    return get_target_coverage(
+        target_vids,
+        graph_rank,
+        bin_by_vid,
+        bin_members,
+        neighbor_bits,
+        n_permutations
+    )
+
+def get_target_coverage(
+    target_vids,
+    graph_rank,
+    bin_by_vid,
+    bin_members,
+    neighbor_bits,
+    n_permutations=100,
+):
+    """
+    Permutation test of the coverage score of a set of targets, as in
+    `get_drug_input_coverage`, for targets already given as vertex ids.
+
+    Parameters
+    ----------
+    target_vids : array_like of int
+        The vertex ids of the targets.
+    graph_rank : numpy.ndarray
+        The graph rank of the nodes in the ppi network, indexed by vertex id,
+        NaN for nodes without a rank.
+    bin_by_vid : numpy.ndarray
+        The degree bin of each node of the ppi network, indexed by vertex id,
+        as returned by `degree_bin_by_vid`.
+    bin_members : dict
+        Nodes of each degree bin as returned by `degree_bin_members`.
+    neighbor_bits : NeighborhoodBits
+        The neighborhoods of the nodes of the ppi network as bitsets, used to
+        score the observed and the random target sets.
+    n_permutations : int, optional
+        The number of random target sets drawn for the permutation test.
+        Default is 100.
+
+    Returns
+    -------
+    tuple
+        A tuple containing the standardized coverage score of the targets and
+        the corresponding p-value.
+    """
+    target_vids = np.asarray(target_vids, dtype=int)
+    # the observed set is scored by the same kernel as the random ones
+    observed = compute_cov_scores(
+        target_vids[None, :], neighbor_bits, graph_rank
+    )[0]
+    random_targets = generate_random_targets(
+        target_vids, bin_by_vid, bin_members, n_permutations
+    )
+    simulated = compute_cov_scores(random_targets, neighbor_bits, graph_rank)
     z_score = (observed - np.mean(simulated)) / np.std(simulated)
     return z_score, norm.cdf(-abs(z_score))
 
-def compute_cov_score(targets, ppi_network, graph_rank, order=1):
+def compute_cov_scores(random_targets, neighbor_bits, graph_rank):
     """
-    Compute the coverage score for a set of drug targets based on the
-    proportion of nodes in the protein-protein interaction network that are
-    covered by the network neighborhood of the targets.
+    Compute the coverage score of many sets of targets at once: the proportion
+    of nodes of the PPI network covered by the network neighborhood of the
+    targets of a set, divided by the median graph rank of the covered nodes.
+    The neighborhood bitsets of the targets of each set are OR-ed together.
 
     Parameters
     ----------
-    targets : list
-        List of protein names corresponding to the drug targets to consider.
-    ppi_network : igraph.Graph
-        Protein-protein interaction network represented as an igraph object.
-    graph_rank : pandas.DataFrame
-        DataFrame containing the graph rank of the nodes in the ppi network,
-        with one column called "rank" and the row index corresponding to node
-        names.
-    order : int, optional
-        The order of the neighborhood of each target to consider. Default is 1.
+    random_targets : numpy.ndarray
+        An array of shape (n_sets, n_targets) with the vertex ids of the
+        targets of each set.
+    neighbor_bits : NeighborhoodBits
+        The neighborhoods of the nodes of the ppi network as bitsets.
+    graph_rank : numpy.ndarray
+        The graph rank of the nodes in the ppi network, indexed by vertex id,
+        NaN for nodes without a rank.
 
     Returns
     -------
-    float
-        The coverage score normalized by the rank of the nodes covered by the
-        drug targets.
-    """
-    target_neighbor_list = dict()
-    for t in targets:
-        target_neighbor_list[t] = [t] + [
-            ppi_network.vs["name"][n] 
-                for n in ppi_network.neighborhood(t, order=order)
-        ]
-    # each target neighbor is only considered once
-    covered_nodes_overall = list(set(it.chain(*[v for k,v in target_neighbor_list.items()])))
-    # take the median of all neighbors considered based on the graph_rank
-    inform_rank = graph_rank.loc[covered_nodes_overall].median(numeric_only=True)[0]
-    # evaluate ppi network coverage
-    coverage_overall = float(len(covered_nodes_overall)) / len(ppi_network.vs)
-    return coverage_overall/inform_rank
+    numpy.ndarray
+        The coverage score of each set of targets.
+    """
+    # each distinct node is expanded once, however many sets it appears in
+    vids, inverse = np.unique(random_targets, return_inverse=True)
+    return score_bitsets(
+        inverse.reshape(random_targets.shape), neighbor_bits[vids], graph_rank
+    )
 
-def generate_random_targets(targets, deg_dist):
+class NeighborhoodBits(object):
     """
-    Randomly generate a set of targets with a degree distribution similar to
+    Network neighborhoods of the nodes of a PPI network stored as bitsets,
+    computed lazily the first time each node is looked up.
+
+    Parameters
+    ----------
+    ppi_network : igraph.Graph
+        The PPI network as an igraph.Graph object.
+    order : int, optional
+        The order of the neighborhood of each node. Default is 1.
+
+    Attributes
+    ----------
+    n_words : int
+        The number of uint64 words of each bitset; bit v % 64 of word v // 64
+        is set when vertex v is in the neighborhood.
+    """
+    def __init__(self, ppi_network, order=1):
+        self.ppi_network = ppi_network
+        self.order = order
+        self.n_words = -(-ppi_network.vcount() // 64)
+        self._rows = dict()
+
+    def __getitem__(self, vids):
+        """
+        Return the bitsets of the given vertex ids as an array of shape
+        (len(vids), n_words) of dtype uint64.
+        """
+        missing = [v for v in vids if v not in self._rows]
+        if missing:
+            neighborhoods = self.ppi_network.neighborhood(
+                missing, order=self.order
+            )
+            for v, neighbors in zip(missing, neighborhoods):
+                members = np.zeros(self.n_words * 64, dtype=bool)
+                members[neighbors] = True
+                self._rows[v] = np.packbits(
+                    members, bitorder="little"
+                ).view(np.uint64)
+        rows = np.empty((len(vids), self.n_words), dtype=np.uint64)
+        for i, v in enumerate(vids):
+            rows[i] = self._rows[v]
+        return rows
+
+def generate_random_targets(
+    targets, bin_by_vid, bin_members, n_permutations=1
+):
+    """
+    Randomly generate sets of targets with a degree distribution similar to
     the input set.
 
     Parameters
     ----------
-    targets : list
-        A list of target nodes to be used as a reference for the degree
-        distribution.
-    deg_dist : pandas.DataFrame
-        A dataframe containing the degree distribution of the ppi network.
+    targets : list of int
+        A list of distinct target vertex ids to be used as a reference for the
+        degree distribution.
+    bin_by_vid : numpy.ndarray
+        The degree bin of each node of the ppi network, indexed by vertex id,
+        as returned by `degree_bin_by_vid`.
+    bin_members : dict
+        Nodes of each degree bin as returned by `degree_bin_members`.
+    n_permutations : int, optional
+        The number of random target sets to draw. Default is 1.
 
     Returns
     -------
-    list
-        A list of nodes with a degree distribution similar to the input set.
+    numpy.ndarray
+        An array of shape (n_permutations, len(targets)), each row holding the
+        vertex ids of a set of nodes with a degree distribution similar to the
+        input set.
 
     """
-    drugNodes_bins = deg_dist.loc[targets].groupby(by="bin").count()
-    random_targets = []
-    for row in drugNodes_bins.itertuples():
-        bin_id, freq = row
-        if freq == 0:
-            continue
-        candidates = deg_dist[deg_dist["bin"] == bin_id]
-        random_targets.extend(
-            candidates.sample(n=freq, replace=False).index.to_list()
-        )
-    return random_targets
-
-
+    bins, freqs = np.unique(
+        bin_by_vid[np.asarray(targets, dtype=int)], return_counts=True
+    )
+    random_targets = [np.empty((n_permutations, 0), dtype=int)]
+    for bin_id, freq in zip(bins, freqs):
+        candidates = bin_members[bin_id]
+        n_candidates = len(candidates)
+        if freq >= n_candidates:
+            # every permutation holds the whole bin
+            picks = np.broadcast_to(
+                np.arange(n_candidates), (n_permutations, n_candidates)
+            )
+        elif freq * freq <= n_candidates:
+            # draw freq positions per row and redraw the rows holding a
+            # duplicate, which few do when the bin is large
+            picks = np.random.randint(
+                n_candidates, size=(n_permutations, freq)
+            )
+            redraw = np.arange(n_permutations)
+            while len(redraw):
+                ordered = np.sort(picks[redraw], axis=1)
+                duplicated = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+                redraw = redraw[duplicated]
+                picks[redraw] = np.random.randint(
+                    n_candidates, size=(len(redraw), freq)
+                )
+        else:
+            # sample without replacement within each row by taking the
+            # positions of the freq smallest values of a random matrix
+            noise = np.random.random((n_permutations, n_candidates))
+            picks = np.argpartition(noise, freq - 1, axis=1)[:, :freq]
+        random_targets.append(candidates[picks])
+    return np.hstack(random_targets)
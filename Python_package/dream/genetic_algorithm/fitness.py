@@ -1,8 +1,138 @@
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import weakref
+
 import numpy as np
 import pandas as pd
 import igraph as ig
 
-from dream.genetic_algorithm.coverage_sum import coverage_sum
+from dream.genetic_algorithm.coverage_sum import get_target_coverage
+from dream.genetic_algorithm.coverage_sum import degree_distribution
+from dream.genetic_algorithm.coverage_sum import degree_bin_members
+from dream.genetic_algorithm.coverage_sum import degree_bin_by_vid
+from dream.genetic_algorithm.coverage_sum import NeighborhoodBits
+from dream.genetic_algorithm.ga_ops import pack_bits
+from dream.genetic_algorithm.ga_ops import unpack_bits
+from dream.genetic_algorithm._kernels import distances_and_counts
+
+def distance_matrix(distances, drug_names):
+    """
+    Build a symmetric distance matrix from a list of pairwise distances.
+
+    Parameters
+    ----------
+    distances : dict or pandas.DataFrame
+        A list of dictionaries of distances with keys: "drug1", "drug2",
+        "distance".
+    drug_names : list
+        The drugs indexing the rows and columns of the matrix. Pairs involving
+        other drugs are ignored.
+
+    Returns
+    -------
+    numpy.ndarray
+        A float32 matrix of shape (len(drug_names), len(drug_names)), with
+        zeros for missing pairs and on the diagonal.
+    """
+    tempdf = pd.DataFrame(distances)
+    index = {name: i for i, name in enumerate(drug_names)}
+    rows = tempdf['drug1'].map(index)
+    cols = tempdf['drug2'].map(index)
+    known = rows.notna() & cols.notna()
+    rows = rows[known].to_numpy(dtype=int)
+    cols = cols[known].to_numpy(dtype=int)
+    values = tempdf.loc[known, 'distance'].fillna(0).to_numpy(dtype=np.float32)
+    mat = np.zeros((len(drug_names), len(drug_names)), dtype=np.float32)
+    mat[rows, cols] = values
+    mat[cols, rows] = values
+    return mat
+
+def drug_target_matrix(drug_targets, drug_names, name_to_vid):
+    """
+    Build a boolean matrix of the network nodes targeted by each drug.
+
+    Parameters
+    ----------
+    drug_targets : pandas.DataFrame
+        DataFrame of drug-target associations with columns
+        "dat.drug.molecule_name" and "dat.target.gene_info.symbol".
+    drug_names : list
+        The drugs indexing the rows of the matrix. Other drugs are ignored.
+    name_to_vid : dict
+        A dictionary mapping node names to vertex ids of the network, indexing
+        the columns of the matrix. Targets missing from it are ignored.
+
+    Returns
+    -------
+    numpy.ndarray
+        A boolean matrix of shape (len(drug_names), len(name_to_vid)).
+    """
+    index = {name: i for i, name in enumerate(drug_names)}
+    rows = drug_targets["dat.drug.molecule_name"].map(index)
+    cols = drug_targets["dat.target.gene_info.symbol"].map(name_to_vid)
+    known = rows.notna() & cols.notna()
+    mat = np.zeros((len(drug_names), len(name_to_vid)), dtype=bool)
+    mat[rows[known].to_numpy(dtype=int), cols[known].to_numpy(dtype=int)] = True
+    return mat
+
+def share_array(array):
+    """
+    Copy an array into a new block of shared memory.
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        The array to share.
+
+    Returns
+    -------
+    shm : multiprocessing.shared_memory.SharedMemory
+        The shared memory block. It must stay open while the view is used.
+    view : numpy.ndarray
+        An array backed by the shared memory block, equal to array.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return shm, view
+
+def attach_array(name, shape, dtype):
+    """
+    Attach to an array shared with `share_array` by another process.
+
+    Parameters
+    ----------
+    name : str
+        The name of the shared memory block.
+    shape : tuple
+        The shape of the array.
+    dtype : str
+        The data type of the array.
+
+    Returns
+    -------
+    shm : multiprocessing.shared_memory.SharedMemory
+        The shared memory block. It must stay open while the view is used.
+    view : numpy.ndarray
+        An array backed by the shared memory block.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return shm, view
+
+def _unlink_shared(names):
+    # the blocks of the owner may still be mapped here, unlink them through
+    # fresh handles
+    for name in names:
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        shm.close()
+        shm.unlink()
+
+# the matrices an EvaluationFunction keeps in shared memory
+SHARED_MATRICES = ("smiles_mat", "moa_mat", "paths_mat")
 
 class EvaluationFunction(object):
     """
@@ -30,34 +160,67 @@ class EvaluationFunction(object):
     drug_targets : dict
         A list of dictionaries of drug targets with keys 
         "dat.drug.molecule_name" and "dat.target.gene_info.symbol".
+    cache_size : int, optional
+        The number of evaluated drug combinations to remember, by default
+        100000. Individuals recur across generations, and a remembered
+        combination is not evaluated again.
 
     Attributes
     ----------
-    smiles_distances : pandas.DataFrame
-        A DataFrame of SMILES distances between drugs.
-    moa_distances : pandas.DataFrame
-        A DataFrame of MOA distances between drugs.
-    paths_distances : pandas.DataFrame
-        A DataFrame of graph distances between drugs.
-    ppi_network : pandas.DataFrame
-        A DataFrame representing the protein-protein interaction network.
+    smiles_mat : numpy.ndarray
+        A symmetric matrix of SMILES distances between drugs, with rows and
+        columns ordered as drug_names. Like moa_mat and paths_mat, it moves
+        to shared memory the first time the object is pickled, and copies of
+        the object in worker processes attach to it instead of receiving the
+        matrix.
+    moa_mat : numpy.ndarray
+        A symmetric matrix of MOA distances between drugs, ordered as
+        drug_names.
+    paths_mat : numpy.ndarray
+        A symmetric matrix of graph distances between drugs, ordered as
+        drug_names.
+    ppi_graph : igraph.Graph
+        The protein-protein interaction network.
+    deg_dist : pandas.DataFrame
+        The degree of each node of ppi_graph and its degree quantile bin.
+    bin_members : dict
+        The vertex ids of the nodes in each degree bin.
+    bin_by_vid : numpy.ndarray
+        The degree bin of each node of ppi_graph, indexed by vertex id.
+    neighbor_bits : NeighborhoodBits
+        The neighborhood of each node of ppi_graph as a bitset, filled in as
+        nodes are drawn in the permutation tests.
     graph_rank : pandas.DataFrame
         A DataFrame representing the graph rank of the targets.
+    name_to_vid : dict
+        A dictionary mapping node names to vertex ids of ppi_graph.
+    rank_by_vid : numpy.ndarray
+        The graph rank of the nodes of ppi_graph, indexed by vertex id, NaN
+        for nodes missing from graph_rank.
     L1000_drug_targets : pandas.DataFrame
         A DataFrame of drug targets.
-    drug_names : list
-        A list of drug names.
+    drug_target_mat : numpy.ndarray
+        A boolean matrix with one row per drug, ordered as drug_names, and one
+        column per node of ppi_graph, True where the node is a target of the
+        drug.
+    drug_names : tuple
+        The names of the drugs, sorted; bit i of an individual selects
+        drug_names[i].
 
     Methods
     -------
-    __call__(individual)
-        Evaluates the drug combination represented by the given binary array.
+    __call__(individuals)
+        Evaluates one drug combination, or a batch of them, reusing the
+        results of previous evaluations of the same combinations.
+    evaluate(individuals)
+        Evaluates drug combinations without looking at the cache.
 
     Returns
     -------
-    tuple
+    tuple or numpy.ndarray
         A tuple of mean SMILES distance, mean MOA distance, mean graph distance,
-        coverage p-value, and number of drugs in the combination.
+        coverage p-value, and number of drugs in the combination, or an array
+        with one such row per drug combination of a batch.
     """
     def __init__(
         self,
@@ -67,74 +230,198 @@ class EvaluationFunction(object):
         ppi_network,
         graph_rank,
         drug_targets,
+        cache_size=100000,
     ):
         """
         Initialize the EvaluationFunction object.
         """
         tempdf = pd.DataFrame.from_dict(smiles_distances)
-        idx = sorted(set(tempdf['drug1']).union(tempdf['drug2']))
-        tempdf = tempdf.pivot(index='drug1', columns='drug2', values='distance').reindex(index=idx, columns=idx).fillna(0, downcast='infer').pipe(lambda x: x+x.values.T)
-        
-        self.smiles_distances = tempdf
-        
-        tempdf = pd.DataFrame.from_dict(moa_distances)
-        idx = sorted(set(tempdf['drug1']).union(tempdf['drug2']))
-        tempdf = tempdf.pivot(index='drug1', columns='drug2', values='distance').reindex(index=idx, columns=idx).fillna(0, downcast='infer').pipe(lambda x: x+x.values.T)
-        
-        self.moa_distances = tempdf
-        
-        tempdf = pd.DataFrame.from_dict(graph_distances)
-        idx = sorted(set(tempdf['drug1']).union(tempdf['drug2']))
-        tempdf = tempdf.pivot(index='drug1', columns='drug2', values='distance').reindex(index=idx, columns=idx).fillna(0, downcast='infer').pipe(lambda x: x+x.values.T)
-        
-        self.paths_distances = tempdf
+        self.drug_names = tuple(
+            sorted(set(tempdf['drug1']).union(tempdf['drug2']))
+        )
+        self._n = len(self.drug_names)
+        # dense matrices aligned to drug_names, indexed by position when
+        # evaluating individuals
+        self.smiles_mat = distance_matrix(tempdf, self.drug_names)
+        self.moa_mat = distance_matrix(moa_distances, self.drug_names)
+        self.paths_mat = distance_matrix(graph_distances, self.drug_names)
         
-        self.ppi_network = pd.DataFrame.from_dict(ppi_network)
+        # the network and its degree bins only depend on the input, build them
+        # once instead of on every evaluation
+        tempdf = pd.DataFrame.from_dict(ppi_network)
+        self.ppi_graph = ig.Graph.TupleList(tempdf.itertuples(index=False), directed=False, weights=False)
+        self.deg_dist = degree_distribution(self.ppi_graph)
+        self.bin_members = degree_bin_members(self.deg_dist)
+        self.bin_by_vid = degree_bin_by_vid(self.deg_dist)
+        self.neighbor_bits = NeighborhoodBits(self.ppi_graph)
         
         
         tempdf = pd.DataFrame.from_dict(graph_rank) #set _row column as index (index from raw data)
         self.graph_rank = tempdf.set_index("gene")
+        # nodes are handled by vertex id while evaluating individuals
+        self.name_to_vid = {
+            name: vid for vid, name in enumerate(self.ppi_graph.vs["name"])
+        }
+        # nodes without a rank are NaN and left out of the median rank
+        self.rank_by_vid = self.graph_rank["rank"].reindex(
+            self.ppi_graph.vs["name"]
+        ).to_numpy(dtype=float)
         
         self.L1000_drug_targets = pd.DataFrame.from_dict(drug_targets)
-        self.drug_names = self.smiles_distances.index.to_list() 
-       
-        
-    def __call__(self, individual):
+        self.drug_target_mat = drug_target_matrix(
+            self.L1000_drug_targets, self.drug_names, self.name_to_vid
+        )
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+        # shared memory blocks of the matrices, made when the object is
+        # first pickled; the matrices stay listed in __dict__ before the
+        # blocks, so the views are released first
+        self._shared = dict()
+
+    def _share_matrices(self):
+        """
+        Move the matrices to shared memory, unlinked when the object is
+        garbage collected.
+        """
+        for attr in SHARED_MATRICES:
+            self._shared[attr], view = share_array(getattr(self, attr))
+            setattr(self, attr, view)
+        weakref.finalize(
+            self, _unlink_shared, [shm.name for shm in self._shared.values()]
+        )
+
+    def __getstate__(self):
+        # processes that do not pickle the object, such as forked workers or
+        # serial runs, never need the shared copies
+        if not self._shared:
+            self._share_matrices()
+        # the cache is local to each process, do not ship it to the workers
+        state = self.__dict__.copy()
+        state["_cache"] = OrderedDict()
+        # the matrices are sent as the names of their shared memory blocks
+        shared = dict()
+        for attr, shm in self._shared.items():
+            view = state.pop(attr)
+            shared[attr] = (shm.name, view.shape, view.dtype.str)
+        state["_shared"] = shared
+        return state
+
+    def __setstate__(self, state):
+        shared = state.pop("_shared")
+        self.__dict__.update(state)
+        handles = dict()
+        for attr, (name, shape, dtype) in shared.items():
+            handles[attr], view = attach_array(name, shape, dtype)
+            setattr(self, attr, view)
+        # set after the views, so they are released before the blocks
+        self._shared = handles
+
+    def __call__(self, individuals):
         """
-        Evaluate the drug combination represented by the given binary array.
+        Evaluate drug combinations, reusing the results of previous
+        evaluations of the same combinations.
 
         Parameters
         ----------
-        individual : array_like
-            A binary array representing a drug combination.
+        individuals : array_like
+            A binary array representing a drug combination, or a 2-D array
+            with one drug combination per row. The bits may also be packed
+            into uint64 words as done by `pack_bits`.
 
         Returns
         -------
-        tuple
-            A tuple of mean SMILES distance, mean MOA distance, mean graph distance,
-            coverage p-value, and number of drugs in the combination.
+        tuple or numpy.ndarray
+            For a single drug combination, a tuple of mean SMILES distance,
+            mean MOA distance, mean graph distance, coverage p-value, and
+            number of drugs in the combination. For a batch, an array of shape
+            (n_individuals, 5) holding these values on each row.
         """
-        if np.sum(individual) <= 1:
-            return (0, 0, 0, 1, len(self.drug_names))
-        candidate_drugs = [
-            self.drug_names[i] for i, bit in enumerate(individual) if bit == 1
-        ]
-       
-        smiles_submat = self.smiles_distances.loc[candidate_drugs, candidate_drugs]
-        moa_submat = self.moa_distances.loc[candidate_drugs, candidate_drugs]
-        paths_submat = self.paths_distances.loc[candidate_drugs, candidate_drugs]
-        _, coverage_pval = coverage_sum(
-            candidate_drugs,
-            self.L1000_drug_targets,
-            self.ppi_network,
-            self.graph_rank
-        )
-        n_drugs = np.sum(individual)
-        linear_index = np.triu_indices(n_drugs, k=1)
-        return (
-            np.mean(smiles_submat.values[linear_index]),
-            np.mean(moa_submat.values[linear_index]),
-            np.mean(paths_submat.values[linear_index]),
-            coverage_pval,
-            n_drugs
+        words, single = self._as_packed(individuals)
+        keys = [row.tobytes() for row in words]
+        # evaluate each combination missing from the cache once, even when it
+        # occurs several times in the batch
+        missing = dict()
+        for i, key in enumerate(keys):
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            elif key not in missing:
+                missing[key] = i
+        if missing:
+            evaluated = self._evaluate_packed(words[list(missing.values())])
+            for key, fit in zip(missing, evaluated.tolist()):
+                self._cache[key] = tuple(fit)
+        fitness = np.array([self._cache[key] for key in keys]).reshape(-1, 5)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return tuple(fitness[0].tolist()) if single else fitness
+
+    def evaluate(self, individuals):
+        """
+        Evaluate drug combinations, bypassing the cache of previous
+        evaluations.
+
+        Parameters
+        ----------
+        individuals : array_like
+            A binary array representing a drug combination, or a 2-D array
+            with one drug combination per row. The bits may also be packed
+            into uint64 words as done by `pack_bits`.
+
+        Returns
+        -------
+        tuple or numpy.ndarray
+            For a single drug combination, a tuple of mean SMILES distance,
+            mean MOA distance, mean graph distance, coverage p-value, and
+            number of drugs in the combination. For a batch, an array of shape
+            (n_individuals, 5) holding these values on each row.
+        """
+        words, single = self._as_packed(individuals)
+        fitness = self._evaluate_packed(words)
+        return tuple(fitness[0].tolist()) if single else fitness
+
+    def _as_packed(self, individuals):
+        """
+        Return the individuals as a 2-D array of packed words, and whether a
+        single individual was given.
+        """
+        individuals = np.asarray(individuals)
+        single = individuals.ndim == 1
+        individuals = np.atleast_2d(individuals)
+        if individuals.dtype != np.uint64:
+            individuals = pack_bits(individuals)
+        return individuals, single
+
+    def _evaluate_packed(self, words):
+        """
+        Evaluate a batch of packed individuals into an array of shape
+        (n_individuals, 5).
+        """
+        n_total = self._n
+        words = np.ascontiguousarray(words, dtype=np.uint64)
+        # the three mean distances and the number of drugs in one pass
+        fitness = np.empty((len(words), 5))
+        fitness[:, [0, 1, 2, 4]] = distances_and_counts(
+            words, n_total, self.smiles_mat, self.moa_mat, self.paths_mat
         )
+        valid = np.flatnonzero(fitness[:, 4] > 1)
+        # combinations of less than two drugs get the worst fitness
+        invalid = np.flatnonzero(fitness[:, 4] <= 1)
+        fitness[invalid] = (0, 0, 0, 1, n_total)
+        if len(valid) == 0:
+            return fitness
+        bits = unpack_bits(words[valid], n_total)
+        for row, i in enumerate(valid):
+            # the targets of the selected drugs that are in the network
+            target_vids = np.flatnonzero(
+                self.drug_target_mat[bits[row]].any(axis=0)
+            )
+            _, fitness[i, 3] = get_target_coverage(
+                target_vids,
+                self.rank_by_vid,
+                self.bin_by_vid,
+                self.bin_members,
+                self.neighbor_bits
+            )
+        return fitness
@@ -1,3 +1,4 @@
+import os
 import numpy as np
 from deap import base
 from deap import creator
@@ -6,9 +7,22 @@ from deap import algorithms
 
 from dream.genetic_algorithm import EvaluationFunction
 from dream.genetic_algorithm import coverage_sum
-from ..parmap import parmap
+from dream.genetic_algorithm.ga_ops import pack_bits
+from dream.genetic_algorithm.ga_ops import unpack_bits
+from dream.genetic_algorithm.ga_ops import var_or_packed
+from dream.genetic_algorithm.ga_ops import PopulationBuffer
+from dream.genetic_algorithm.nsga2_fast import IncrementalNSGA2
+from dream.genetic_algorithm.pareto_front import FastParetoFront
+from ..parmap import parmap_batched
+from ..parmap import WorkerPool
 import functools
 
+# logbook keys of the mean of each fitness value, in the order of the values
+STATS_FIELDS = ("avg_smile", "avg_moa", "avg_paths", "avg_coverage", "n_drugs")
+# the distances are maximized, the coverage p-value and the number of drugs
+# minimized
+FITNESS_WEIGHTS = np.array([1.0, 1.0, 1.0, -1.0, -1.0])
+
 def genetic_algorithm(
     smiles_distances,
     moa_distances,
@@ -23,6 +37,7 @@ def genetic_algorithm(
     crossover_prob=0.7,
     mutation_prob=0.3,
     n_generations=2500,
+    n_jobs=None,
     verbose=False,
     ):
     """
@@ -67,15 +82,20 @@ def genetic_algorithm(
         The probability of performing mutation on an individual, by default 0.3.
     n_generations : int, optional
         The number of generations to run the algorithm for, by default 2500.
+    n_jobs : int, optional
+        The number of worker processes evaluating the fitness of the
+        individuals, by default the number of CPUs. With 1 the individuals are
+        evaluated in the current process.
     verbose : bool, optional
         Whether to print verbose output during the algorithm, by default False.
 
     Returns
     -------
-    drug_names : list
-        A list of the names of the drugs in the dataset.
+    drug_names : tuple
+        The names of the drugs in the dataset.
     population : list
-        A list of the individuals in the final population.
+        A list of the individuals in the final population, each an array of
+        the drug bits packed into uint64 words (see `ga_ops.unpack_bits`).
     logbook : tools.Logbook
         A logbook containing statistics about the algorithm during each generation.
     solutions : list
@@ -96,23 +116,29 @@ def genetic_algorithm(
         evaluate,
         population_size,
         attribute_init_prob,
-        attribute_mutation_prob
+        attribute_mutation_prob,
+        n_jobs,
+        n_offsprings
     )
 
-    population = toolbox.population()
-    population = toolbox.select(population, len(population))
-
-    population, logbook = run_genetic_algorithm(
-        population,
-        toolbox,
-        crossover_prob,
-        mutation_prob,
-        n_generations,
-        n_offsprings,
-        stats,
-        hall_of_fame,
-        verbose
-    )
+    try:
+        population = toolbox.population()
+        population = toolbox.select(population, len(population))
+
+        population, logbook = run_genetic_algorithm(
+            population,
+            toolbox,
+            crossover_prob,
+            mutation_prob,
+            n_generations,
+            n_offsprings,
+            stats,
+            hall_of_fame,
+            verbose
+        )
+    finally:
+        if toolbox.pool is not None:
+            toolbox.pool.shutdown()
     solutions = parse_hall_of_fame(hall_of_fame, evaluate.drug_names)
 
     return evaluate.drug_names, population, logbook, solutions
@@ -121,7 +147,9 @@ def setup_genetic_algorithm(
     fitness_function,
     population_size,
     attribute_init_prob,
-    attribute_mutation_prob
+    attribute_mutation_prob,
+    n_jobs=None,
+    n_offsprings=None
 ):
     """
     Set up the genetic algorithm for drug combination optimization using NSGA-II.
@@ -137,62 +165,181 @@ def setup_genetic_algorithm(
         initialization of an individual.
     attribute_mutation_prob : float
         The probability of mutating an attribute of an individual.
+    n_jobs : int, optional
+        The number of worker processes evaluating the fitness function, by
+        default the number of CPUs. With 1 the evaluation runs serially in the
+        current process.
+    n_offsprings : int, optional
+        The number of offspring generated in each generation. When given, the
+        population and the offspring are stored in the rows of a single
+        PopulationBuffer, and the toolbox gets a compact method moving the
+        selected individuals back to the population rows.
 
     Returns
     -------
     toolbox : deap.base.Toolbox
-        The toolbox containing the operators for the genetic algorithm.
+        The toolbox containing the operators for the genetic algorithm. Its
+        pool attribute holds the WorkerPool evaluating the individuals, or
+        None when n_jobs is 1; shut it down once the run is over.
     stats : deap.tools.Statistics
         The statistics object to collect and report statistics on the population.
-    hall_of_fame : deap.tools.ParetoFront
+    hall_of_fame : FastParetoFront
         The Pareto front object to store the best individuals seen during the optimization process.
     """
     ...
 
     creator.create(
-        "Fitness", base.Fitness, weights=(1.0, 1.0, 1.0, -1.0, -1.0)
+        "Fitness", base.Fitness, weights=tuple(FITNESS_WEIGHTS.tolist())
     )
-    creator.create("Individual", list, fitness=creator.Fitness)
+    # individuals hold one bit per drug, packed into uint64 words
+    creator.create("Individual", np.ndarray, fitness=creator.Fitness)
 
-    IND_SIZE = len(fitness_function.drug_names)
+    IND_SIZE = fitness_function._n
 
     toolbox = base.Toolbox()
-    toolbox.register("map", parmap, max_workers=16)
-    toolbox.register(
-        "init_attribute", lambda: np.random.random() < attribute_init_prob
-    )
-    toolbox.register(
-        "individual",
-        tools.initRepeat,
-        creator.Individual,
-        toolbox.init_attribute,
-        n=IND_SIZE
-    )
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+    if n_jobs > 1:
+        # each run has workers of its own, which receive the fitness function
+        # once; each task only carries the individuals
+        toolbox.pool = WorkerPool(n_jobs)
+        evaluate = toolbox.pool.register(fitness_function)
+    else:
+        toolbox.pool = None
+        evaluate = fitness_function
+    if n_offsprings is None:
+        buffer = None
+        toolbox.register(
+            "population",
+            init_population,
+            creator.Individual,
+            population_size,
+            IND_SIZE,
+            attribute_init_prob
+        )
+    else:
+        buffer = PopulationBuffer(
+            creator.Individual,
+            creator.Fitness,
+            population_size,
+            n_offsprings,
+            IND_SIZE
+        )
+        toolbox.register(
+            "population", buffer.init_population, attribute_init_prob
+        )
+        toolbox.register("compact", buffer.compact)
+
     toolbox.register(
-        "population",
-        tools.initRepeat,
-        list,
-        toolbox.individual,
-        n=population_size
+        "batch_evaluate",
+        batch_evaluate,
+        evaluate=evaluate,
+        pool=toolbox.pool,
+        buffer=buffer
     )
-
-    toolbox.register("evaluate", fitness_function)
+    # varOr specialized to one point crossover and shuffle mutation of
+    # packed individuals
     toolbox.register(
-        "mutate", tools.mutShuffleIndexes, indpb=attribute_mutation_prob
+        "vary",
+        var_or_packed,
+        indpb=attribute_mutation_prob,
+        n_bits=IND_SIZE,
+        buffer=buffer
     )
-    toolbox.register("mate", tools.cxOnePoint)
-    toolbox.register("select", tools.selNSGA2)
+    # selections after the first one reuse the dominance relations among
+    # the survivors
+    toolbox.register("select", IncrementalNSGA2())
 
     stats = tools.Statistics(lambda ind: ind.fitness.values)
-    stats.register("avg_smile", lambda x: np.mean(x, axis=0)[0])
-    stats.register("avg_moa", lambda x: np.mean(x, axis=0)[1])
-    stats.register("avg_paths", lambda x: np.mean(x, axis=0)[2])
-    stats.register("avg_coverage", lambda x: np.mean(x, axis=0)[3])
-    stats.register("n_drugs", lambda x: np.mean(x, axis=0)[4])
+    # one reduction for all the fitness values, split into STATS_FIELDS when
+    # recorded
+    stats.register("means", lambda x: np.mean(x, axis=0))
 
-    hall_of_fame = tools.ParetoFront()
+    # numpy individuals cannot be compared with ==
+    hall_of_fame = FastParetoFront(similar=np.array_equal)
     return toolbox, stats, hall_of_fame
 
+def init_population(individual_class, population_size, n_bits, init_prob):
+    """
+    Generate a population of random packed individuals.
+
+    Parameters
+    ----------
+    individual_class : type
+        The numpy array subclass of the individuals.
+    population_size : int
+        The number of individuals to generate.
+    n_bits : int
+        The number of drugs encoded in each individual.
+    init_prob : float
+        The probability of adding each drug to an individual.
+
+    Returns
+    -------
+    list
+        A list of individuals.
+    """
+    bits = np.random.random((population_size, n_bits)) < init_prob
+    return [individual_class(words) for words in pack_bits(bits)]
+
+def batch_evaluate(individuals, evaluate, pool=None, buffer=None):
+    """
+    Evaluate a list of individuals as one batch, split in a contiguous chunk
+    per worker process when running in parallel.
+
+    Parameters
+    ----------
+    individuals : list
+        A list of individuals.
+    evaluate : callable
+        The fitness function, taking a 2-D array with one individual per row
+        and returning an array with the fitness values of each row.
+    pool : WorkerPool, optional
+        The worker processes evaluating the chunks. By default the batch is
+        evaluated in the current process.
+    buffer : PopulationBuffer, optional
+        The buffer storing the individuals. When they are consecutive rows of
+        it, as the new offspring are, these rows are evaluated in place
+        instead of being stacked into a new array.
+
+    Returns
+    -------
+    numpy.ndarray
+        An array with the fitness values of each individual on a row.
+    """
+    individuals = list(individuals)
+    if not individuals:
+        return np.empty((0, 0))
+    rows = None if buffer is None else buffer.rows(individuals)
+    if rows is not None:
+        batch = buffer.words[rows]
+    else:
+        batch = np.stack(individuals)
+    if pool is not None:
+        return parmap_batched(evaluate, batch, pool=pool)
+    return evaluate(batch)
+
+def assign_fitness(individuals, fitness, weights=FITNESS_WEIGHTS):
+    """
+    Set the fitness of individuals from an array of fitness values, weighting
+    all of them at once instead of through the setter of each fitness.
+
+    Parameters
+    ----------
+    individuals : list
+        A list of individuals sharing the same fitness class.
+    fitness : numpy.ndarray
+        An array with the fitness values of each individual on a row.
+    weights : numpy.ndarray, optional
+        The weights of the fitness class of the individuals, by default
+        FITNESS_WEIGHTS.
+    """
+    if not individuals:
+        return
+    weighted = (np.asarray(fitness, dtype=float) * weights).tolist()
+    for ind, wvalues in zip(individuals, weighted):
+        ind.fitness.wvalues = tuple(wvalues)
+
 def run_genetic_algorithm(
     population,
     toolbox,
@@ -202,7 +349,8 @@ def run_genetic_algorithm(
     noffspring,
     stats=None,
     hall_of_fame=None,
-    verbose=False
+    verbose=False,
+    hall_of_fame_interval=10
 ):
     """
     Runs a genetic algorithm to generate combinations of drugs that minimize a
@@ -216,8 +364,13 @@ def run_genetic_algorithm(
     population : list
         A list of individuals comprising the initial population.
     toolbox : Toolbox
-        A Toolbox object that contains the methods for performing various
-        genetic operations (selection, crossover, mutation).
+        A Toolbox object that contains the select method and the
+        batch_evaluate method evaluating a list of individuals. When it has a
+        vary method, it produces the offspring, as in the toolbox built by
+        `setup_genetic_algorithm`. Otherwise `deap.algorithms.varOr` does,
+        and the toolbox must register the mate and mutate operators. When it
+        has a compact method, it is applied to each new population, and the
+        offspring kept for the hall of fame are copied.
     cxpb : float
         The probability of mating two individuals.
     mutpb : float
@@ -235,6 +388,10 @@ def run_genetic_algorithm(
     verbose : bool, optional
         If True, information about the evolutionary process will be printed to
         the console. Default is False.
+    hall_of_fame_interval : int, optional
+        The number of generations whose offspring are gathered before updating
+        the hall of fame with them in one batch. The final hall of fame does not
+        depend on it. Default is 10.
 
     Returns
     -------
@@ -245,47 +402,91 @@ def run_genetic_algorithm(
     """
     ...
     logbook = tools.Logbook()
-    logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+    fields = []
+    for field in (stats.fields if stats else []):
+        fields.extend(STATS_FIELDS if field == "means" else [field])
+    logbook.header = ['gen', 'nevals'] + fields
 
     # Evaluate the individuals with an invalid fitness
     invalid_ind = [ind for ind in population if not ind.fitness.valid]
-    evals = toolbox.map(toolbox.evaluate, invalid_ind)
-    for ind, fit in zip(invalid_ind, evals):
-        ind.fitness.values = fit
+    assign_fitness(invalid_ind, toolbox.batch_evaluate(invalid_ind))
 
     if hall_of_fame is not None:
         hall_of_fame.update(population)
 
-    record = stats.compile(population) if stats else {}
+    record = compile_stats(stats, population)
     logbook.record(gen=0, nevals=len(invalid_ind), **record)
     if verbose:
         print(logbook.stream)
 
+    # offspring waiting for the next batched update of the hall of fame
+    pending = []
+
     # Begin the generational process
     for gen in range(1, ngen + 1):
         # Generate new offspring
-        offspring = algorithms.varOr(population, toolbox, noffspring, cxpb, mutpb)
+        if hasattr(toolbox, "vary"):
+            offspring = toolbox.vary(population, noffspring, cxpb, mutpb)
+        else:
+            offspring = algorithms.varOr(
+                population, toolbox, noffspring, cxpb, mutpb
+            )
 
         # evaluate the offspring
-        evals = toolbox.map(toolbox.evaluate, offspring)
-        for ind, fit in zip(offspring, evals):
-            ind.fitness.values = fit
+        # offspring obtained by reproduction keep the fitness of their parent
+        invalid = [ind for ind in offspring if not ind.fitness.valid]
+        assign_fitness(invalid, toolbox.batch_evaluate(invalid))
 
         # Select the next generation of fittest individuals
         population = toolbox.select(population+offspring, len(population))
+        if hasattr(toolbox, "compact"):
+            # the survivors go back to the population rows of the buffer
+            population = toolbox.compact(population)
 
         # Update the hall of fame with the generated individuals
         if hall_of_fame is not None:
-            hall_of_fame.update(offspring)
+            if hasattr(toolbox, "compact"):
+                # the next offspring overwrite the rows of these ones
+                pending.extend(map(toolbox.clone, offspring))
+            else:
+                pending.extend(offspring)
+            if gen % hall_of_fame_interval == 0 or gen == ngen:
+                hall_of_fame.update(pending)
+                pending = []
 
         # Append the current generation statistics to the logbook
-        record = stats.compile(population) if stats else {}
+        record = compile_stats(stats, population)
         logbook.record(gen=gen, nevals=len(invalid_ind), **record)
         if verbose:
             print(logbook.stream)
 
     return population, logbook
 
+def compile_stats(stats, population):
+    """
+    Compute the statistics of a population, splitting the vector of mean
+    fitness values into one entry per fitness value.
+
+    Parameters
+    ----------
+    stats : deap.tools.Statistics or None
+        The statistics to compute.
+    population : list
+        A list of individuals.
+
+    Returns
+    -------
+    dict
+        The statistics of the population, with the means of the fitness values
+        under the keys in STATS_FIELDS.
+    """
+    if stats is None:
+        return {}
+    record = stats.compile(population)
+    if "means" in record:
+        record.update(zip(STATS_FIELDS, record.pop("means")))
+    return record
+
 def parse_hall_of_fame(hall_of_fame, drug_names):
     """
     Extracts and returns the solutions from the Pareto front of a genetic
@@ -295,8 +496,9 @@ def parse_hall_of_fame(hall_of_fame, drug_names):
     ----------
     hall_of_fame : deap.tools.ParetoFront
         A ParetoFront object that contains the individuals in the Pareto front.
-    drug_names : list
-        A list containing the names of the drugs being optimized.
+    drug_names : tuple
+        The names of the drugs being optimized, in the order of the bits of
+        the individuals.
 
     Returns
     -------
@@ -305,10 +507,15 @@ def parse_hall_of_fame(hall_of_fame, drug_names):
         fitness values of each solution.
     """
     solutions = []
-    for individual in hall_of_fame:
-        names = tuple(drug_names[i] for i, bit in enumerate(individual) if bit)
+    if len(hall_of_fame) == 0:
+        return solutions
+    names = np.array(drug_names, dtype=object)
+    bits = unpack_bits(np.stack(list(hall_of_fame)), len(drug_names))
+    for individual, selected in zip(hall_of_fame, bits):
         fitness = individual.fitness
-        solutions.append((names, parse_fitness(fitness.values)))
+        solutions.append(
+            (tuple(names[selected].tolist()), parse_fitness(fitness.values))
+        )
     return solutions
 
 def parse_fitness(values):
@@ -0,0 +1,295 @@
+import random
+from copy import deepcopy
+import numpy as np
+from dream.genetic_algorithm._kernels import copy_tail
+from dream.genetic_algorithm._kernels import swap_bits
+from dream.genetic_algorithm._kernels import swap_tails
+
+def pack_bits(bits):
+    """
+    Pack binary arrays into uint64 words, 64 drugs per word.
+
+    Parameters
+    ----------
+    bits : array_like
+        A binary array of shape (..., n_bits).
+
+    Returns
+    -------
+    numpy.ndarray
+        A uint64 array of shape (..., ceil(n_bits / 64)); bit i % 64 of word
+        i // 64 holds bit i of the input. Padding bits are zero.
+    """
+    bits = np.asarray(bits, dtype=bool)
+    n_words = -(-bits.shape[-1] // 64)
+    padded = np.zeros(bits.shape[:-1] + (n_words * 64,), dtype=bool)
+    padded[..., :bits.shape[-1]] = bits
+    packed = np.packbits(padded, axis=-1, bitorder="little")
+    return packed.view("<u8").astype(np.uint64, copy=False)
+
+def unpack_bits(words, n_bits):
+    """
+    Unpack uint64 words produced by `pack_bits` back into binary arrays.
+
+    Parameters
+    ----------
+    words : array_like
+        A uint64 array of shape (..., n_words).
+    n_bits : int
+        The number of meaningful bits.
+
+    Returns
+    -------
+    numpy.ndarray
+        A boolean array of shape (..., n_bits).
+    """
+    words = np.ascontiguousarray(words, dtype="<u8")
+    bits = np.unpackbits(words.view(np.uint8), axis=-1, bitorder="little")
+    return bits[..., :n_bits].view(bool)
+
+def cx_one_point_packed(ind1, ind2, n_bits):
+    """
+    One point crossover of two packed individuals, in place, like
+    `deap.tools.cxOnePoint` on the unpacked bits.
+
+    Parameters
+    ----------
+    ind1, ind2 : numpy.ndarray
+        The uint64 words of the individuals.
+    n_bits : int
+        The number of drugs encoded in the individuals.
+
+    Returns
+    -------
+    tuple
+        The two individuals.
+    """
+    cxpoint = random.randint(1, n_bits - 1)
+    swap_tails(np.asarray(ind1), np.asarray(ind2), cxpoint)
+    return ind1, ind2
+
+def mut_shuffle_packed(individual, indpb, n_bits):
+    """
+    Shuffle the bits of a packed individual, in place, like
+    `deap.tools.mutShuffleIndexes` on the unpacked bits.
+
+    Parameters
+    ----------
+    individual : numpy.ndarray
+        The uint64 words of the individual.
+    indpb : float
+        The independent probability of each bit to be swapped with another.
+    n_bits : int
+        The number of drugs encoded in the individual.
+
+    Returns
+    -------
+    tuple
+        A tuple holding the individual.
+    """
+    # the draws stay outside the kernel, numba keeps a random state of its own
+    # that np.random.seed does not reach
+    positions = np.flatnonzero(np.random.random(n_bits) < indpb)
+    partners = np.random.randint(0, n_bits - 1, size=len(positions))
+    partners += partners >= positions
+    swap_bits(np.asarray(individual), positions, partners)
+    return individual,
+
+def var_or_packed(
+    population, n_offspring, cxpb, mutpb, indpb, n_bits, buffer=None
+):
+    """
+    Generate offspring from packed individuals by crossover, mutation or
+    reproduction, like `deap.algorithms.varOr` with `cx_one_point_packed` and
+    `mut_shuffle_packed` as operators, without going through the toolbox.
+
+    Parameters
+    ----------
+    population : list
+        A list of packed individuals to vary.
+    n_offspring : int
+        The number of offspring to produce.
+    cxpb : float
+        The probability of producing an offspring by crossover.
+    mutpb : float
+        The probability of producing an offspring by mutation.
+    indpb : float
+        The independent probability of each bit to be swapped when mutating.
+    n_bits : int
+        The number of drugs encoded in the individuals.
+    buffer : PopulationBuffer, optional
+        When given, the offspring are written in the offspring rows of the
+        buffer instead of being allocated one by one. The offspring with an
+        invalid fitness fill the first rows, in order, so that they can be
+        evaluated in place; reproduced ones fill the last rows.
+
+    Returns
+    -------
+    list
+        A list of offspring. Offspring produced by crossover or mutation are
+        new individuals with an invalid fitness. Reproduced ones are the
+        individuals of the population themselves, or copies of them with
+        their fitness when written in a buffer.
+    """
+    assert (cxpb + mutpb) <= 1.0, (
+        "The sum of the crossover and mutation probabilities must be smaller "
+        "or equal to 1.0."
+    )
+    # the random draws follow the order of deap.algorithms.varOr
+    offspring = []
+    # next offspring rows of the buffer for new and for reproduced offspring
+    n_new, n_reproduced = 0, 0
+    for _ in range(n_offspring):
+        op_choice = random.random()
+        if op_choice < cxpb:
+            parent1, parent2 = random.sample(population, 2)
+            child = _fresh_copy(parent1, buffer, n_new)
+            n_new += 1
+            # only the first child of the crossover is kept
+            copy_tail(child, np.asarray(parent2), random.randint(1, n_bits - 1))
+        elif op_choice < cxpb + mutpb:
+            child = _fresh_copy(random.choice(population), buffer, n_new)
+            n_new += 1
+            mut_shuffle_packed(child, indpb, n_bits)
+        else:
+            child = random.choice(population)
+            if buffer is not None:
+                parent = child
+                n_reproduced += 1
+                child = _fresh_copy(parent, buffer, n_offspring - n_reproduced)
+                child.fitness = deepcopy(parent.fitness)
+        offspring.append(child)
+    return offspring
+
+def _fresh_copy(individual, buffer=None, n=0):
+    # copy the words into a new individual with an invalid fitness, stored in
+    # the n-th offspring row of the buffer if any
+    if buffer is None:
+        child = individual.copy()
+        child.fitness = type(individual.fitness)()
+    else:
+        child = buffer.individual(buffer.population_size + n)
+        child[:] = individual
+    return child
+
+class PopulationBuffer(object):
+    """
+    Contiguous storage of the packed individuals of a population and of its
+    offspring. Individuals are views of the rows of one array: the
+    population in the first population_size rows, followed by the offspring.
+
+    Parameters
+    ----------
+    individual_class : type
+        The numpy array subclass of the individuals.
+    fitness_class : type
+        The fitness class of the individuals.
+    population_size : int
+        The number of individuals of the population.
+    n_offspring : int
+        The number of offspring produced at each generation.
+    n_bits : int
+        The number of drugs encoded in each individual.
+
+    Attributes
+    ----------
+    words : numpy.ndarray
+        The uint64 words of all the individuals, one individual per row.
+    """
+    def __init__(
+        self,
+        individual_class,
+        fitness_class,
+        population_size,
+        n_offspring,
+        n_bits
+    ):
+        self.individual_class = individual_class
+        self.fitness_class = fitness_class
+        self.population_size = population_size
+        self.n_bits = n_bits
+        self.words = np.zeros(
+            (population_size + n_offspring, -(-n_bits // 64)), dtype=np.uint64
+        )
+
+    def individual(self, row, fitness=None):
+        """
+        Return the individual stored in a row, with the given fitness or a new
+        invalid one.
+        """
+        individual = self.words[row].view(self.individual_class)
+        if fitness is None:
+            fitness = self.fitness_class()
+        individual.fitness = fitness
+        return individual
+
+    def rows(self, individuals):
+        """
+        Locate individuals stored in consecutive rows of the buffer.
+
+        Parameters
+        ----------
+        individuals : list
+            A list of individuals.
+
+        Returns
+        -------
+        slice or None
+            The rows holding the individuals, in order, or None when they are
+            not views of consecutive rows of the buffer.
+        """
+        stride = self.words.strides[0]
+        first = self.words.ctypes.data
+        offsets = np.array(
+            [individual.ctypes.data for individual in individuals]
+        ) - first
+        start = offsets[0] // stride
+        stop = start + len(offsets)
+        if (
+            offsets[0] % stride != 0
+            or not 0 <= start <= stop <= len(self.words)
+            or np.any(np.diff(offsets) != stride)
+        ):
+            return None
+        return slice(int(start), int(stop))
+
+    def init_population(self, init_prob):
+        """
+        Fill the population rows with random individuals.
+
+        Parameters
+        ----------
+        init_prob : float
+            The probability of adding each drug to an individual.
+
+        Returns
+        -------
+        list
+            The individuals of the population.
+        """
+        bits = np.random.random((self.population_size, self.n_bits)) < init_prob
+        self.words[:self.population_size] = pack_bits(bits)
+        return [self.individual(row) for row in range(self.population_size)]
+
+    def compact(self, survivors):
+        """
+        Move the selected individuals to the population rows, in order, so
+        that the offspring rows can be reused.
+
+        Parameters
+        ----------
+        survivors : list
+            The individuals of the next population, stored in any row.
+
+        Returns
+        -------
+        list
+            The individuals of the next population, stored in the population
+            rows and carrying the fitness of the survivors.
+        """
+        # copy out first, survivors may come from rows that are overwritten
+        self.words[:len(survivors)] = np.stack(survivors)
+        return [
+            self.individual(row, individual.fitness)
+            for row, individual in enumerate(survivors)
+        ]
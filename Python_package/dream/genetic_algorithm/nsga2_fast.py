@@ -0,0 +1,245 @@
+import numpy as np
+
+def select_nsga2(individuals, k):
+    """
+    NSGA-II selection working on the matrix of fitness values of the
+    individuals, a drop-in replacement of `deap.tools.selNSGA2`.
+
+    Parameters
+    ----------
+    individuals : list
+        A list of individuals to select from.
+    k : int
+        The number of individuals to select.
+
+    Returns
+    -------
+    list
+        A list of the selected individuals. As with `deap.tools.selNSGA2`,
+        the individuals are ordered by front, the crowding distance is
+        stored in the `crowding_dist` attribute of their fitness, and ties
+        are broken in the same order.
+    """
+    if k == 0:
+        return []
+    chosen = _select(individuals, k, _weighted_fitness(individuals))
+    return [individuals[i] for i in chosen]
+
+class IncrementalNSGA2(object):
+    """
+    NSGA-II selection remembering the dominance matrix of the individuals it
+    selected, for a drop-in replacement of `deap.tools.selNSGA2` in loops
+    that select from the previous selection followed by new offspring.
+
+    When the first individuals passed match the previous selection, only the
+    dominance relations involving the new individuals are computed. The
+    selection is the same as that of `select_nsga2`.
+
+    Parameters
+    ----------
+    refresh_interval : int, optional
+        The number of calls after which the dominance matrix is recomputed
+        from scratch, by default 50.
+    """
+    def __init__(self, refresh_interval=50):
+        self.refresh_interval = refresh_interval
+        self._calls = 0
+        self._wvalues = None
+        self._dominates = None
+
+    def __call__(self, individuals, k):
+        """
+        Select k individuals, as `select_nsga2` does.
+        """
+        if k == 0:
+            return []
+        wvalues = _weighted_fitness(individuals)
+        self._calls += 1
+        n_old = 0 if self._wvalues is None else len(self._wvalues)
+        reuse = (
+            self._calls % self.refresh_interval != 0
+            and 0 < n_old <= len(wvalues)
+            and self._wvalues.shape[1] == wvalues.shape[1]
+            and np.array_equal(wvalues[:n_old], self._wvalues)
+        )
+        if reuse:
+            old, new = wvalues[:n_old], wvalues[n_old:]
+            dominates = np.block([
+                [self._dominates, dominance_matrix(old, new)],
+                [dominance_matrix(new, old), dominance_matrix(new)],
+            ])
+        else:
+            dominates = dominance_matrix(wvalues)
+        chosen = _select(individuals, k, wvalues, dominates)
+        self._wvalues = wvalues[chosen]
+        self._dominates = dominates[np.ix_(chosen, chosen)]
+        return [individuals[i] for i in chosen]
+
+def _weighted_fitness(individuals):
+    # unevaluated individuals have empty fitnesses, none dominates another
+    return np.array(
+        [ind.fitness.wvalues for ind in individuals], dtype=float
+    ).reshape(len(individuals), -1)
+
+def _select(individuals, k, wvalues, dominates=None):
+    """
+    Indices of the individuals selected by NSGA-II, setting the crowding
+    distance of the individuals of the sorted fronts.
+    """
+    values = np.array(
+        [ind.fitness.values for ind in individuals], dtype=float
+    ).reshape(len(individuals), -1)
+    keys = [ind.fitness.wvalues for ind in individuals]
+    fronts = sort_nondominated(wvalues, k, dominates, keys)
+    chosen = []
+    for i, front in enumerate(fronts):
+        distances = crowding_distance(values[front])
+        for j, distance in zip(front, distances.tolist()):
+            individuals[j].fitness.crowding_dist = distance
+        if i < len(fronts) - 1:
+            chosen.extend(front.tolist())
+        else:
+            # the last front is cut, keep its least crowded individuals
+            if np.isnan(distances).any():
+                # NaN distances do not sort with numpy as with sorted
+                key = distances.tolist()
+                order = sorted(
+                    range(len(front)), key=key.__getitem__, reverse=True
+                )
+            else:
+                order = np.argsort(-distances, kind="stable")
+            chosen.extend(front[order[:k - len(chosen)]].tolist())
+    return chosen
+
+def dominance_matrix(wvalues, others=None):
+    """
+    Compare the weighted fitness values of two sets of individuals.
+
+    Parameters
+    ----------
+    wvalues : numpy.ndarray
+        An array of shape (n, n_objectives) of weighted fitness values, to be
+        maximized.
+    others : numpy.ndarray, optional
+        An array of shape (m, n_objectives) of weighted fitness values, by
+        default wvalues.
+
+    Returns
+    -------
+    numpy.ndarray
+        A boolean array of shape (n, m), True at [i, j] when individual i of
+        wvalues dominates individual j of others.
+    """
+    if others is None:
+        others = wvalues
+    # as in deap.base.Fitness.dominates, an objective where either value is
+    # NaN is neither better nor worse
+    return (
+        ~(wvalues[:, None, :] < others[None, :, :]).any(axis=-1)
+        & (wvalues[:, None, :] > others[None, :, :]).any(axis=-1)
+    )
+
+def sort_nondominated(wvalues, k, dominates=None, keys=None):
+    """
+    Sort individuals into Pareto fronts until at least k of them are sorted.
+
+    Parameters
+    ----------
+    wvalues : numpy.ndarray
+        An array of shape (n_individuals, n_objectives) of weighted fitness
+        values, to be maximized.
+    k : int
+        The number of individuals to sort.
+    dominates : numpy.ndarray, optional
+        The dominance matrix of the individuals as returned by
+        `dominance_matrix`, computed when not given.
+    keys : list, optional
+        The weighted fitness values of the individuals as tuples, by default
+        the rows of wvalues. Individuals with equal keys are sorted together;
+        passing the wvalues of the fitnesses groups fitnesses holding NaN
+        values as deap does.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        The indices of the individuals in each front, the first front
+        holding the non-dominated individuals. Individuals are ordered as
+        `deap.tools.sortNondominated` orders them.
+    """
+    n = len(wvalues)
+    if keys is None:
+        keys = map(tuple, wvalues.tolist())
+    # identical fitnesses are sorted together, numbered by first occurrence;
+    # a dict compares them as the dict of deap.tools.sortNondominated does
+    groups = dict()
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+    members = [np.array(group) for group in groups.values()]
+    sizes = np.array([len(group) for group in members])
+    representatives = np.array([group[0] for group in members])
+    fits = wvalues[representatives]
+
+    if dominates is None:
+        dominates = dominance_matrix(fits)
+    else:
+        dominates = dominates[np.ix_(representatives, representatives)]
+    n_dominators = dominates.sum(axis=0)
+
+    current = np.flatnonzero(n_dominators == 0)
+    fit_fronts = [current]
+    n_sorted = sizes[current].sum()
+    while n_sorted < min(n, k):
+        released = dominates[current]
+        n_dominators -= released.sum(axis=0)
+        following = np.flatnonzero((n_dominators == 0) & released.any(axis=0))
+        if len(following) == 0:
+            # only possible when NaN values make the dominance cyclic
+            break
+        # a fitness joins the next front when its last dominator in the
+        # current front is released
+        last = len(current) - 1 - np.argmax(released[::-1, following], axis=0)
+        following = following[np.lexsort((following, last))]
+        fit_fronts.append(following)
+        n_sorted += sizes[following].sum()
+        current = following
+
+    return [
+        np.concatenate([members[g] for g in front]) for front in fit_fronts
+    ]
+
+def crowding_distance(values):
+    """
+    Compute the crowding distance of the individuals of a front.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        An array of shape (n_individuals, n_objectives) of fitness values.
+
+    Returns
+    -------
+    numpy.ndarray
+        The crowding distance of each individual, infinite for the boundary
+        individuals of each objective.
+    """
+    n, n_obj = values.shape
+    distances = np.zeros(n)
+    if n == 0:
+        return distances
+    # each objective sorts the order left by the previous one, as DEAP does
+    order = np.arange(n)
+    for i in range(n_obj):
+        if np.isnan(values[:, i]).any():
+            # NaN values do not sort with numpy as with list.sort
+            key = values[:, i].tolist()
+            order = np.array(sorted(order.tolist(), key=key.__getitem__))
+        else:
+            order = order[np.argsort(values[order, i], kind="stable")]
+        column = values[order, i]
+        distances[order[0]] = np.inf
+        distances[order[-1]] = np.inf
+        if column[-1] == column[0]:
+            continue
+        norm = n_obj * (column[-1] - column[0])
+        distances[order[1:-1]] += (column[2:] - column[:-2]) / norm
+    return distances
@@ -0,0 +1,112 @@
+from copy import deepcopy
+from operator import eq
+import numpy as np
+from deap import tools
+
+from dream.genetic_algorithm.nsga2_fast import dominance_matrix
+
+class FastParetoFront(tools.ParetoFront):
+    """
+    Pareto front hall of fame updated with vectorized dominance checks, a
+    drop-in replacement of `deap.tools.ParetoFront`.
+
+    The weighted fitness values of the front are kept in an array, and each
+    update compares a whole batch of individuals with the front and with each
+    other at once. The front holds the same individuals, in the same order,
+    as `deap.tools.ParetoFront` updated with the same individuals.
+
+    Parameters
+    ----------
+    similar : callable, optional
+        A function telling whether two individuals with the same fitness are
+        the same, by default `operator.eq`.
+
+    Attributes
+    ----------
+    wvalues : numpy.ndarray
+        The weighted fitness values of the individuals in the front, one row
+        per individual.
+    """
+    def __init__(self, similar=eq):
+        tools.ParetoFront.__init__(self, similar)
+        self.wvalues = None
+        self._seen_nan = False
+
+    def update(self, population):
+        """
+        Update the front with the individuals of the population that are not
+        dominated by the front or by the rest of the population, and remove
+        the individuals of the front they dominate. Once individuals with NaN
+        fitness values have been passed, the individuals are inserted one at
+        a time by `deap.tools.ParetoFront.update`.
+
+        Parameters
+        ----------
+        population : list
+            A list of individuals with a valid fitness.
+        """
+        population = list(population)
+        if not population:
+            return
+        new = np.array([ind.fitness.wvalues for ind in population], dtype=float)
+        if self.wvalues is None:
+            self.wvalues = np.empty((0, new.shape[1]))
+        self._seen_nan = self._seen_nan or bool(np.isnan(new).any())
+        if self._seen_nan:
+            # with NaN values dominance is not transitive, and the front
+            # depends on the order the individuals are inserted in; it may
+            # keep individuals dominated by others even once the NaN values
+            # are gone
+            tools.ParetoFront.update(self, population)
+            return
+        n_front = len(self.items)
+        wvalues = np.vstack([self.wvalues, new])
+        kept = ~dominance_matrix(wvalues).any(axis=0)
+
+        # among kept individuals with the same fitness, drop the later ones
+        # similar to an earlier one
+        survivors = np.flatnonzero(kept[:n_front]).tolist()
+        candidates = self.items + population
+        inserted = []
+        for j in n_front + np.flatnonzero(kept[n_front:]):
+            twins = np.flatnonzero((wvalues[survivors] == wvalues[j]).all(axis=1))
+            if any(
+                self.similar(candidates[j], candidates[survivors[t]])
+                for t in twins
+            ):
+                continue
+            survivors.append(j)
+            inserted.append(j)
+
+        # sort by decreasing fitness, newer individuals first among equal
+        # fitnesses, as deap.tools.HallOfFame.insert does
+        order = np.array(
+            inserted[::-1] + survivors[:len(survivors) - len(inserted)],
+            dtype=int
+        )
+        order = order[np.lexsort(-wvalues[order].T[::-1])]
+        # the front keeps its own copies of the new individuals
+        self.items = [
+            candidates[i] if i < n_front else deepcopy(candidates[i])
+            for i in order.tolist()
+        ]
+        self.keys = [item.fitness for item in reversed(self.items)]
+        self.wvalues = wvalues[order]
+
+    def insert(self, item):
+        tools.ParetoFront.insert(self, item)
+        self._seen_nan = self._seen_nan or bool(
+            np.isnan(item.fitness.wvalues).any()
+        )
+        self.wvalues = np.array(
+            [ind.fitness.wvalues for ind in self.items], dtype=float
+        ).reshape(len(self.items), -1)
+
+    def remove(self, index):
+        tools.ParetoFront.remove(self, index)
+        self.wvalues = np.delete(self.wvalues, index, axis=0)
+
+    def clear(self):
+        tools.ParetoFront.clear(self)
+        self.wvalues = None
+        self._seen_nan = False
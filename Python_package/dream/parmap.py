@@ -1,6 +1,139 @@
+import uuid
+import weakref
+import threading
 from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
-def parmap(func, iterable, max_workers=8):
+# in the processes of a WorkerPool, the functions registered with it; filled
+# by the pool initializer
+_PAYLOAD = dict()
+
+class WorkerPool(object):
+    """
+    A pool of processes owned by one user, such as a run of the genetic
+    algorithm. Functions registered with it are sent to each worker once,
+    when the worker starts, instead of being pickled with every task.
+
+    The processes are started by the first call to map, and stopped by
+    shutdown, at the end of a with block, or when the pool is garbage
+    collected.
+
+    Parameters
+    ----------
+    max_workers : int, optional (default=8)
+        The maximum number of processes to use.
+    """
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._payload = dict()
+        self._executor = None
+        self._finalizer = None
+        self._lock = threading.Lock()
+
+    def register(self, func):
+        """
+        Register a function to be shipped to the workers when they start.
+
+        Parameters
+        ----------
+        func : callable
+            The function to register. It must be picklable.
+
+        Returns
+        -------
+        RegisteredFunction
+            A lightweight, picklable callable that looks up and calls the
+            registered function in the worker it runs in.
+
+        Raises
+        ------
+        RuntimeError
+            If the workers have already started.
+        """
+        with self._lock:
+            if self._executor is not None:
+                raise RuntimeError(
+                    "Functions must be registered before the workers start"
+                )
+            # a key of its own, so that pools never mix up their functions
+            key = uuid.uuid4().hex
+            self._payload[key] = func
+        return RegisteredFunction(key)
+
+    def map(self, func, iterable, chunksize=1):
+        """
+        Apply a function to each element of an iterable in the workers.
+
+        Parameters
+        ----------
+        func : callable
+            The function to apply, usually returned by `register`.
+        iterable : iterable
+            The iterable containing the data to be processed.
+        chunksize : int, optional (default=1)
+            The number of elements sent to a worker in each task.
+
+        Returns
+        -------
+        list
+            The results, in the order of the elements.
+        """
+        with self._lock:
+            if self._executor is not None and self._executor._broken:
+                # a worker died, later calls get fresh processes
+                self._finalizer()
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(self._payload,)
+                )
+                # stop the processes if the pool is dropped without shutdown
+                self._finalizer = weakref.finalize(
+                    self, self._executor.shutdown
+                )
+            # the tasks are all submitted before the lock is released
+            results = self._executor.map(func, iterable, chunksize=chunksize)
+        return list(results)
+
+    def shutdown(self):
+        """
+        Stop the worker processes, waiting for the tasks they are running.
+        The next call to map starts new ones.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._finalizer()
+                self._executor = None
+                self._finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+class RegisteredFunction(object):
+    """
+    Callable proxy to a function registered with `WorkerPool.register`.
+    Pickling it only sends the key of the function.
+
+    Parameters
+    ----------
+    key : str
+        The name the function is registered under.
+    """
+    def __init__(self, key):
+        self.key = key
+
+    def __call__(self, *args, **kwargs):
+        return _PAYLOAD[self.key](*args, **kwargs)
+
+def _init_worker(payload):
+    _PAYLOAD.update(payload)
+
+def parmap(func, iterable, max_workers=8, pool=None):
     """
     Apply a given function to each element of an iterable in parallel using a
     pool of processes.
@@ -13,15 +146,57 @@ def parmap(func, iterable, max_workers=8):
         The iterable containing the data to be processed.
     max_workers : int, optional (default=8)
         The maximum number of processes to use.
+    pool : WorkerPool, optional
+        The pool running the tasks, whose size replaces max_workers. By
+        default a pool of processes is started for this call only.
 
     Returns
     -------
     list
         A list containing the result of applying the function to each element
         of the iterable in parallel.
+
+    Notes
+    -----
+    The functions registered with a WorkerPool are sent to each of its
+    workers once when it starts; pass the returned proxy as `func`, with the
+    pool, to avoid pickling large functions with every task.
     """
-    results = []
+    items = list(iterable)
+    if pool is not None:
+        max_workers = pool.max_workers
+    # a few chunks per worker balance the load without one task per item
+    chunksize = max(1, len(items) // (max_workers * 4))
+    if pool is not None:
+        return pool.map(func, items, chunksize=chunksize)
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        for i in executor.map(func, iterable):
-            results.append(i)
-    return results
+        return list(executor.map(func, items, chunksize=chunksize))
+
+def parmap_batched(func, batch, max_workers=8, pool=None):
+    """
+    Apply a function taking a batch of rows to contiguous chunks of an array
+    in parallel, one chunk per worker process.
+
+    Parameters
+    ----------
+    func : callable
+        The function to apply to each chunk. It takes a 2-D array and returns
+        an array with one result per row.
+    batch : numpy.ndarray
+        The array whose rows are processed.
+    max_workers : int, optional (default=8)
+        The maximum number of processes to use.
+    pool : WorkerPool, optional
+        The pool running the chunks, whose size replaces max_workers. By
+        default a pool of processes is started for this call only.
+
+    Returns
+    -------
+    numpy.ndarray
+        The results of the chunks, concatenated in the order of the rows.
+    """
+    if pool is not None:
+        max_workers = pool.max_workers
+    n_chunks = max(1, min(max_workers, len(batch)))
+    chunks = np.array_split(batch, n_chunks)
+    return np.concatenate(parmap(func, chunks, max_workers, pool))